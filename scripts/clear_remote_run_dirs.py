@@ -5,13 +5,27 @@ from __future__ import annotations
 
 import argparse
 import socket
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
-import paramiko
-
+from remotescript._sshpool import get_client
 from remotescript._utils import parse_config
 
 
+def _clear_one(
+    command: str,
+    machine: tuple[str, str, str, str, int | None],
+) -> None:
+    machine_name, hostname, user, password, port = machine
+    try:
+        with get_client(hostname, user, password, port, timeout=5) as client:
+            _, stdout, _ = client.exec_command(command)
+            stdout.channel.recv_exit_status()
+    except (socket.timeout, OSError):
+        print(f"Error connecting to remote machine: {machine_name}")
+
+
 def main() -> None:
     """Delete the run directories on the remote machines."""
     parser = argparse.ArgumentParser()
@@ -21,6 +35,11 @@ def main() -> None:
         type=str,
         required=True,
     )
+    parser.add_argument(
+        "--venvs",
+        action="store_true",
+        help="Also delete the cached virtual environments.",
+    )
     args = parser.parse_args()
     config = args.config
     config_path = Path(config)
@@ -31,22 +50,17 @@ def main() -> None:
         print("Configuration file is not a file.")
         return
 
-    for (machine_name, hostname, user, password, port) in parse_config(config_path):
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            client.connect(
-                hostname=hostname,
-                username=user,
-                password=password,
-                port=port if port is not None else 22,
-                timeout=5,
-            )
-        except (socket.timeout, OSError):
-            print(f"Error connecting to remote machine: {machine_name}")
-            continue
-        
-        client.exec_command("rm -rf runs")
+    command = "rm -rf runs"
+    if args.venvs:
+        command += " .remotescript/venvs"
+
+    # clear all machines concurrently, connections are closed on exit
+    machines = parse_config(config_path)
+    if not machines:
+        return
+    with ThreadPoolExecutor(max_workers=min(32, len(machines))) as executor:
+        list(executor.map(partial(_clear_one, command), machines))
+
 
 if __name__ == "__main__":
     main()
@@ -89,12 +89,14 @@ if level is not None and level.upper() not in [
 __author__ = "Justin Davis"
 __version__ = "0.0.3"
 
-from . import _core, _imports, _utils
+from . import _core, _imports, _sshpool, _transfer, _utils
 from ._core import check_bash, run_script
 
 __all__ = [
     "_core",
     "_imports",
+    "_sshpool",
+    "_transfer",
     "_utils",
     "check_bash",
     "run_script",
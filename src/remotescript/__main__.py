@@ -6,8 +6,10 @@
 from __future__ import annotations
 
 import logging
+from functools import partial
+from queue import Empty, Queue
 from threading import Thread
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
 
 from ._core import run_script
 from ._imports import (
@@ -23,21 +25,42 @@ if TYPE_CHECKING:
 _log = logging.getLogger(__name__)
 
 
+def _run_jobs(jobs: list[tuple[str, Callable[[], object]]], num_workers: int) -> None:
+    # the jobs are drained by a bounded number of threads, a job which raises
+    # is logged and skipped so one bad machine does not stop the others
+    queue: Queue[tuple[str, Callable[[], object]]] = Queue()
+    for job in jobs:
+        queue.put(job)
+
+    def _worker() -> None:
+        while True:
+            try:
+                machine_name, job = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                job()
+            except Exception:  # noqa: BLE001
+                _log.exception(f"{machine_name}: Run failed with an unexpected error")
+
+    threads: list[Thread] = [
+        Thread(target=_worker, daemon=True) for _ in range(num_workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
 def main() -> None:
     """Run the main program."""
-    (
-        script_path,
-        config_path,
-        output_dir_path,
-        datafiles,
-        deps,
-        dep_scripts,
-        dep_dirs,
-        timeout,
-        use_site_packages,
-        no_venv,
-    ) = parse_arguments()
-    config = parse_config(config_path)
+    args = parse_arguments()
+    script_path = args.script
+    output_dir_path = args.output_dir
+    deps = args.requirements
+    dep_scripts = args.dep_scripts
+    dep_dirs = args.dep_dirs
+    config = parse_config(args.config, args.config_kind)
 
     # generate the output directory
     output_dir_path.mkdir(parents=True, exist_ok=True)
@@ -64,42 +87,41 @@ def main() -> None:
         imports: list[tuple[str, str]] = parse_and_trim_imports(script_path)
         valid_imports: list[str] = compare_and_prune_libs(imports)
         deps = output_dir_path / "requirements.txt"
-        deps.touch()
         deps.write_text(generate_requirements(valid_imports))
         _log.debug(f"Generated requirements file: {deps}")
 
-    # create thread for each machines connection
-    threads: list[Thread] = []
-    for (machine_name, hostname, user, password, port), m_output_dir in zip(
-        config,
-        machine_output_dirs,
-    ):
-        threads.append(
-            Thread(
-                target=run_script,
-                args=(
-                    machine_name,
-                    hostname,
-                    user,
-                    password,
-                    port,
-                    script_path,
-                    m_output_dir,
-                    deps,
-                    datafiles,
-                    dep_scripts,
-                    dep_dirs,
-                    timeout,
-                    use_site_packages,
-                    no_venv,
-                ),
-                daemon=True,
+    # a job for each machine, run by a bounded number of threads
+    jobs: list[tuple[str, Callable[[], object]]] = [
+        (
+            machine_name,
+            partial(
+                run_script,
+                machine_name,
+                hostname,
+                user,
+                password,
+                port,
+                script_path,
+                m_output_dir,
+                deps,
+                args.datafiles,
+                dep_scripts,
+                dep_dirs,
+                args.timeout,
+                use_system_site_packages=args.use_site_packages,
+                no_venv=args.no_venv,
+                venv_cache=not args.no_venv_cache,
             ),
         )
-    for thread in threads:
-        thread.start()
-    for thread in threads:
-        thread.join()
+        for (machine_name, hostname, user, password, port), m_output_dir in zip(
+            config,
+            machine_output_dirs,
+        )
+    ]
+    num_workers = (
+        len(config) if args.workers is None else min(args.workers, len(config))
+    )
+    _run_jobs(jobs, num_workers)
 
 
 if __name__ == "__main__":
@@ -1,83 +1,115 @@
 # Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
 #
 # MIT License
-# ruff: noqa: S507
 from __future__ import annotations
 
-import contextlib
+import hashlib
 import json
 import logging
+import re
+import select
+import shlex
 import socket
 import threading
 import time
-from functools import partial
 from typing import TYPE_CHECKING
 
 import paramiko
-import scp  # type: ignore[import-untyped]
+
+from ._sshpool import acquire_client, release_client
+from ._transfer import get_dir, put_archive
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
     from pathlib import Path
 
 
 _log = logging.getLogger(__name__)
 
-
-def check_bash(client: paramiko.SSHClient) -> str | None:
+_VENV_CACHE_DIRECTORY = ".remotescript/venvs"
+_PIP_CACHE_DIRECTORY = "$HOME/.cache/remotescript/pip"
+_RECV_SIZE = 2**16
+_STAGE_MARKER = "__REMOTESCRIPT_STAGE__"
+_STAGE_RE = re.compile(rf"{_STAGE_MARKER} (\w+) (\d+) (\d+(?:[.,]\d+)?)\n")
+_BASH_PREFIX = "__REMOTESCRIPT_BASH__ "
+_BASH_CACHE: dict[tuple[str, str, int | None], str] = {}
+_BASH_CACHE_LOCK = threading.Lock()
+_STAGE_ERRORS = {
+    "check_python": "Python3 not found, exiting.",
+    "extract_files": "Could not extract the transferred files",
+    "lock_venv": "Could not lock the cached virtualenv",
+    "create_venv": "Could not create virtualenv",
+    "install_deps": "Error installing the dependencies",
+    "mark_venv": "Could not mark the cached virtualenv as ready",
+}
+
+
+def check_bash(
+    client: paramiko.SSHClient,
+    host_key: tuple[str, str, int | None] | None = None,
+) -> str | None:
     """
     Check if bash is available on the remote machine.
 
+    The common locations of bash are probed first, followed by any found
+    with locate, all within a single command on the remote machine.
+
     Parameters
     ----------
     client : paramiko.SSHClient
         The client to check for bash on.
+    host_key : tuple[str, str, int | None] | None
+        The hostname, user, and port of the machine.
+        If given, the bash found is cached for the lifetime of
+        the process and reused by later checks with the same key.
+        If None, the check is always run.
 
     Returns
     -------
     str | None
-        The version of bash found.
+        The path of the first working bash found.
 
     """
-
-    def _check_bash(client: paramiko.SSHClient, bash: str) -> str | None:
-        with contextlib.suppress(paramiko.SSHException):
-            _, bash_stdout, bash_stderr = client.exec_command(f"{bash} --version")
-            if not bash_stderr.read().decode() and len(bash_stdout.read().decode()) > 0:
-                return bash
-        return None
-
-    # checking the basic versions of bash
-    basic_bash = ["bash", "/bin/bash", "/usr/bin/bash"]
-    for bash in basic_bash:
-        bash_version = _check_bash(client, bash)
-        if bash_version is not None:
-            return bash_version
-
-    # check if the locate command is available
+    if host_key is not None:
+        with _BASH_CACHE_LOCK:
+            cached = _BASH_CACHE.get(host_key)
+        if cached is not None:
+            return cached
+
+    # run through sh, since the login shell of the user may not be POSIX
+    # locate is only queried if none of the common locations work, the path
+    # is prefixed so output from the login shell, such as from .bashrc, is skipped
+    probe = (
+        f'do "$b" --version >/dev/null 2>&1 && echo "{_BASH_PREFIX}$b" && exit; done'
+    )
+    script = (
+        f"for b in bash /bin/bash /usr/bin/bash; {probe};"
+        f" for b in $(locate bash 2>/dev/null | grep /bash$); {probe}"
+    )
+    command = f"sh -c {shlex.quote(script)}"
     try:
-        _, locate_stdout, locate_stderr = client.exec_command("locate bash")
-        if locate_stderr.read().decode():
-            return None
-        locate_output = locate_stdout.read().decode().split("\n")
-        potential_bash = []
-        for pbash in locate_output:
-            pbash_name = pbash.split("/")[-1]
-            # bash binary wont have suffix
-            # if "." in pbash_name:
-            #     continue
-            if pbash_name == "bash":
-                potential_bash.append(pbash)
+        stdout, _, _ = run_command(client, command)
     except paramiko.SSHException:
         return None
+    bash = next(
+        (
+            line[len(_BASH_PREFIX) :]
+            for line in stdout.splitlines()
+            if line.startswith(_BASH_PREFIX)
+        ),
+        None,
+    )
+    if bash is None:
+        return None
+    if host_key is not None:
+        with _BASH_CACHE_LOCK:
+            _BASH_CACHE[host_key] = bash
+    return bash
 
-    # check the potential bash binaries
-    for pbash in potential_bash:
-        bash_version = _check_bash(client, pbash)
-        if bash_version is not None:
-            return bash_version
 
-    return None
+def clear_bash_cache() -> None:
+    """Clear the cached locations of bash found by check_bash."""
+    with _BASH_CACHE_LOCK:
+        _BASH_CACHE.clear()
 
 
 def write_stdout_stderr(
@@ -111,14 +143,17 @@ def write_stdout_stderr(
     # write stdout, stderr to files
     stdout_path = output_dir / stdout_name
     stderr_path = output_dir / stderr_name
-    stdout_path.touch(exist_ok=True)
-    stderr_path.touch(exist_ok=True)
     stdout_path.write_text(stdout)
     stderr_path.write_text(stderr)
     _log.debug(f"{machine_name}: Wrote stdout, stderr to files")
 
 
-def write_output_json(output_dir: Path, st: int, et: int) -> None:
+def write_output_json(
+    output_dir: Path,
+    st: float,
+    et: float,
+    exit_status: int | None = None,
+) -> None:
     """
     Write the output.json file.
 
@@ -126,28 +161,36 @@ def write_output_json(output_dir: Path, st: int, et: int) -> None:
     ----------
     output_dir : Path
         The output directory to write the file to.
-    st : int
+    st : float
         The start time of the script.
-    et : int
+    et : float
         The end time of the script.
+    exit_status : int | None
+        The exit status of the script.
+        If None, the exit status is unknown.
 
     """
-    total = et - st
+    # the remote times have at most microsecond precision
+    total = round(et - st, 6)
     output_json = {
         "start_time": st,
         "end_time": et,
         "total_time": total,
+        "exit_status": exit_status,
     }
+    # write to a temporary file first, so output.json is never left partially written
     output_json_path = output_dir / "output.json"
-    output_json_path.touch(exist_ok=True)
-    with output_json_path.open("w") as f:
-        json.dump(output_json, f, indent=4)
+    tmp_path = output_dir / "output.json.tmp"
+    tmp_path.write_text(json.dumps(output_json, indent=4))
+    tmp_path.replace(output_json_path)
 
 
 def wrap_command(bash: str, command: str) -> str:
     """
     Wrap the command in the bash command.
 
+    The command is quoted, so it may contain any characters.
+
     Parameters
     ----------
     bash : str
@@ -161,7 +204,159 @@ def wrap_command(bash: str, command: str) -> str:
         The wrapped command.
 
     """
-    return f"{bash} -c '{command}'"
+    return f"{shlex.quote(bash)} -c {shlex.quote(command)}"
+
+
+def venv_cache_key(deps: Path | None, *, use_system_site_packages: bool) -> str:
+    """
+    Compute the key of a cached virtual environment.
+
+    Parameters
+    ----------
+    deps : Path | None
+        The requirements file installed into the environment.
+    use_system_site_packages : bool
+        Whether the environment uses the system site packages.
+
+    Returns
+    -------
+    str
+        The key of the environment.
+
+    """
+    hasher = hashlib.sha256(deps.read_bytes() if deps is not None else b"")
+    if use_system_site_packages:
+        hasher.update(b"--system-site-packages")
+    return hasher.hexdigest()[:16]
+
+
+def compose_stages(stages: list[tuple[str, str, bool]]) -> str:
+    """
+    Compose multiple commands into a single script separated by markers.
+
+    Each stage echoes a marker containing the stage name, the exit status
+    of the previous stage, and the current time to both stdout and stderr
+    before running, allowing the output of a single command execution
+    to be split and timed per stage.
+
+    Parameters
+    ----------
+    stages : list[tuple[str, str, bool]]
+        The stages to compose, in the form (name, command, required).
+        If a required stage fails, the script exits with a non-zero status.
+
+    Returns
+    -------
+    str
+        The composed script.
+
+    """
+    lines: list[str] = []
+    for name, command, required in [*stages, ("done", "", False)]:
+        # the status is expanded before the date command can overwrite it,
+        # bash 5 provides the time with microseconds without running date
+        marker = f'echo "{_STAGE_MARKER} {name} $_rs_stage"'
+        lines.extend(
+            ['_rs_stage="$? ${EPOCHREALTIME:-$(date +%s)}"', marker, f"{marker} >&2"],
+        )
+        if command:
+            lines.append(f"( {command} ) || exit 1" if required else f"( {command} )")
+    # kept on a single line, since the script is passed as a quoted argument
+    # through the login shell, and csh and tcsh reject newlines inside quotes
+    return "; ".join(lines)
+
+
+def split_stages(text: str) -> list[tuple[str, float, float, int | None, str]]:
+    """
+    Split the output of a composed script into its stages.
+
+    Parameters
+    ----------
+    text : str
+        The stdout or stderr of a script created by compose_stages.
+
+    Returns
+    -------
+    list[tuple[str, float, float, int | None, str]]
+        The stages in the form (name, start time, end time, exit status, output).
+        The end time and exit status are taken from the marker of the next stage,
+        if there is no next stage the end time is the start time and the exit
+        status is None. Any output before the first marker is given the name "".
+
+    """
+    parts = _STAGE_RE.split(text)
+    markers = [
+        (
+            parts[idx],
+            int(parts[idx + 1]),
+            # the decimal separator of the remote locale may be a comma
+            float(parts[idx + 2].replace(",", ".")),
+            parts[idx + 3],
+        )
+        for idx in range(1, len(parts), 4)
+    ]
+    stages: list[tuple[str, float, float, int | None, str]] = []
+    start = markers[0][2] if markers else 0.0
+    name, output = "", parts[0]
+    for next_name, status, stamp, next_output in markers:
+        stages.append((name, start, stamp, status, output))
+        name, start, output = next_name, stamp, next_output
+    stages.append((name, start, start, None, output))
+    return stages
+
+
+def run_command(client: paramiko.SSHClient, command: str) -> tuple[str, str, int]:
+    """
+    Run a command on the remote machine and collect its output.
+
+    The stdout and stderr of the command are read concurrently in chunks
+    as they arrive, so a command writing a large amount to one stream
+    cannot stall on the other. Invalid utf-8 in the output is replaced.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        The client to run the command with.
+    command : str
+        The command to run.
+
+    Returns
+    -------
+    tuple[str, str, int]
+        The stdout, stderr, and exit status of the command.
+
+    Raises
+    ------
+    paramiko.SSHException
+        If the client is not connected or the command could not be run.
+
+    """
+    transport = client.get_transport()
+    if transport is None:
+        err_msg = "Client is not connected"
+        raise paramiko.SSHException(err_msg)
+    stdout_chunks: list[bytes] = []
+    stderr_chunks: list[bytes] = []
+    with transport.open_session() as channel:
+        channel.exec_command(command)
+        while True:
+            # the channel becomes readable on data for either stream or on EOF
+            select.select([channel], [], [])
+            while channel.recv_ready():
+                stdout_chunks.append(channel.recv(_RECV_SIZE))
+            while channel.recv_stderr_ready():
+                stderr_chunks.append(channel.recv_stderr(_RECV_SIZE))
+            if (channel.eof_received or channel.closed) and not (
+                channel.recv_ready() or channel.recv_stderr_ready()
+            ):
+                break
+        status = channel.recv_exit_status()
+    # output of the script is not guaranteed to be valid utf-8
+    return (
+        b"".join(stdout_chunks).decode(errors="replace"),
+        b"".join(stderr_chunks).decode(errors="replace"),
+        status,
+    )
 
 
 def heartbeat(
@@ -205,12 +400,9 @@ def heartbeat(
             err_msg = "Transport is None, exiting heartbeat"
             _log.error(err_msg)
             raise ValueError(err_msg)
-        tag = time.time()
-        while not event.is_set():
-            if time.time() - tag > interval:
-                transport.send_ignore()
-                tag = time.time()
-            event.wait(1.0)
+        # only wakes up to send the heartbeat, or when the event is set
+        while not event.wait(interval):
+            transport.send_ignore()
 
     event = threading.Event()
     thread = threading.Thread(
@@ -256,6 +448,7 @@ def run_script(
     transfer_run_dir: bool | None = None,
     use_system_site_packages: bool | None = None,
     no_venv: bool | None = None,
+    venv_cache: bool | None = None,
 ) -> bool:
     """
     Run the script on the remote machine.
@@ -301,6 +494,11 @@ def run_script(
         If None, the default is False.
         If there are dependencies, they will be installed to the system
         site packages. Use caution when setting this to True.
+    venv_cache : bool | None
+        Whether to reuse a virtual environment cached on the remote machine.
+        The cached environment is keyed by the contents of the requirements
+        and use_system_site_packages, and is kept after the script runs.
+        If None, the default is True.
 
     Returns
     -------
@@ -317,9 +515,11 @@ def run_script(
         mn: str,
         hthread: threading.Thread,
         hevent: threading.Event,
+        cl: paramiko.SSHClient,
     ) -> bool:
         write_stdout_stderr(odp, out, err, mn)
         close_heartbeat(hthread, hevent)
+        release_client(cl)
         return False
 
     # begin run_script
@@ -332,28 +532,23 @@ def run_script(
         use_system_site_packages = False
     if no_venv is None:
         no_venv = False
+    if venv_cache is None:
+        venv_cache = True
 
     # begin running logs for stdout and stderr of the script
     stdout = ""
     stderr = ""
 
-    # create client and connect
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # get a connected client, reusing an existing connection if possible
     try:
-        client.connect(
-            hostname=hostname,
-            username=user,
-            password=password,
-            port=port if port is not None else 22,
-            timeout=timeout,
-        )
+        client = acquire_client(hostname, user, password, port, timeout)
     except socket.timeout:
         _log.error(f"{machine_name}: Connection timed out, exiting.")
         write_stdout_stderr(output_dir_path, stdout, stderr, machine_name)
         return False
-    except OSError as er:
-        _log.error(f"{machine_name}: Socket error: {er}")
+    except (paramiko.SSHException, OSError) as er:
+        # includes failed logins and rejected host keys
+        _log.error(f"{machine_name}: Could not connect: {er}")
         write_stdout_stderr(output_dir_path, stdout, stderr, machine_name)
         return False
     _log.debug(f"{machine_name}: Connected")
@@ -367,25 +562,8 @@ def run_script(
         )
         _log.error(f"{machine_name}: {err_msg}")
 
-    # check for python3
-    try:
-        _, py3_stdout, py3_stderr = client.exec_command("python3 --version")
-        _log.debug(f"{machine_name}: Python3 found")
-        stdout += py3_stdout.read().decode()
-        stderr += py3_stderr.read().decode()
-    except paramiko.SSHException:
-        _log.error(f"{machine_name}: Python3 not found, exiting.")
-        return early_exit(
-            output_dir_path,
-            stdout,
-            stderr,
-            machine_name,
-            heartbeat_thread,
-            heartbeat_event,
-        )
-
     # check for bash and create command wrapper
-    bash = check_bash(client)
+    bash = check_bash(client, (hostname, user, port))
     if bash is None:
         err_msg = "Bash not found, exiting."
         _log.error(f"{machine_name}: {err_msg}")
@@ -396,96 +574,39 @@ def run_script(
             machine_name,
             heartbeat_thread,
             heartbeat_event,
+            client,
         )
 
-    com_wrap: Callable[[str], str] = partial(wrap_command, bash)
-    if bash is None:
-        _log.error(f"{machine_name}: Bash not found, exiting.")
-        return early_exit(
-            output_dir_path,
-            stdout,
-            stderr,
-            machine_name,
-            heartbeat_thread,
-            heartbeat_event,
-        )
     _log.debug(f"{machine_name}: Bash found")
 
-    # create new directory for which to run the script and create
-    # the virtual environment
     base_directory = "runs"
     run_directory = f"run_{int(time.time())}"
     machine_directory = f"{base_directory}/{run_directory}"
-    try:
-        mk_command = f"mkdir -p {machine_directory}"
-        _, mk_stdoutt, mk_stderr = client.exec_command(com_wrap(mk_command))
-        _log.debug(
-            f"{machine_name}: Created directory for execution, {machine_directory}",
-        )
-        stdout += mk_stdoutt.read().decode()
-        stderr += mk_stderr.read().decode()
-    except paramiko.SSHException:
-        _log.error(f"{machine_name}: Could not create virtualenv directory")
-        return early_exit(
-            output_dir_path,
-            stdout,
-            stderr,
-            machine_name,
-            heartbeat_thread,
-            heartbeat_event,
-        )
 
-    # create the scp_client
+    # create the directory for which to run the script and transfer the files,
+    # all files are sent as a single archive which is extracted remotely
+    payload: list[tuple[Path, str]] = [(script_path, "script.py")]
+    if datafiles is not None:
+        payload.extend((datafile, datafile.name) for datafile in datafiles)
+    if deps is not None:
+        payload.append((deps, "requirements.txt"))
+    if dep_scripts is not None:
+        payload.extend((dep_script, dep_script.name) for dep_script in dep_scripts)
+    if dep_dirs is not None:
+        payload.extend((dep_dir, dep_dir.name) for dep_dir in dep_dirs)
+    payload_path = f"{machine_directory}/payload.tar"
     try:
-        scp_client = scp.SCPClient(client.get_transport())
-        _log.debug(f"{machine_name}: Created SCPClient")
-    except scp.SCPException as err:
-        _log.error(f"{machine_name}: Could not create SCPClient: {err}")
-        return early_exit(
-            output_dir_path,
-            stdout,
-            stderr,
-            machine_name,
-            heartbeat_thread,
-            heartbeat_event,
+        put_archive(
+            client,
+            payload_path,
+            payload,
+            parents=[base_directory, machine_directory],
         )
-
-    # transfer the files
-    try:
-        scp_client.put(str(script_path), f"{machine_directory}/script.py")
         _log.debug(
-            f"{machine_name}: Transferred {script_path} to {machine_directory}/script.py",
+            f"{machine_name}: Created directory for execution, {machine_directory}",
         )
-        if datafiles is not None:
-            for datafile in datafiles:
-                scp_client.put(str(datafile), f"{machine_directory}/{datafile.name}")
-                _log.debug(
-                    f"{machine_name}: Transferred datafile {datafile} to {machine_directory}/{datafile.name}",
-                )
-        if deps is not None:
-            scp_client.put(str(deps), f"{machine_directory}/requirements.txt")
-            _log.debug(f"{machine_name}: Transferred requirements file")
-        if dep_scripts is not None:
-            for dep_script in dep_scripts:
-                scp_client.put(
-                    str(dep_script),
-                    f"{machine_directory}/{dep_script.name}",
-                )
-                _log.debug(
-                    f"{machine_name}: Transferred dependency script {dep_script}",
-                )
-        if dep_dirs is not None:
-            for dep_dir in dep_dirs:
-                scp_client.put(
-                    str(dep_dir),
-                    f"{machine_directory}/{dep_dir.name}",
-                    recursive=True,
-                )
-                _log.debug(
-                    f"{machine_name}: Transferred dependency directory {dep_dir}",
-                )
-        _log.debug(f"{machine_name}: Transferred all files")
-    except scp.SCPException as err:
+        _log.debug(f"{machine_name}: Transferred {len(payload)} files and directories")
+    except (paramiko.SSHException, OSError) as err:
         _log.error(f"{machine_name}: Could not transfer files: {err}")
         return early_exit(
             output_dir_path,
@@ -494,101 +615,100 @@ def run_script(
             machine_name,
             heartbeat_thread,
             heartbeat_event,
+            client,
         )
 
-    # ensure virtualenv is installed
-    try:
-        upip_com = "python3 -m pip install --upgrade pip"
-        # assume the upgrade pip line will be successfull
-        client.exec_command(com_wrap(upip_com))
-        venv_install_com = "python3 -m pip install virtualenv"
-        _, venv_install_stdout, venv_install_stderr = client.exec_command(
-            com_wrap(venv_install_com),
+    # check for python3, build the virtual environment, install the dependencies,
+    # run the script, and clean the environment in a single command to save round-trips
+    # a cached environment is only reused once its dependencies installed successfully
+    use_cache = venv_cache and not no_venv
+    if use_cache:
+        cache_key = venv_cache_key(
+            deps,
+            use_system_site_packages=use_system_site_packages,
         )
-        stdout += venv_install_stdout.read().decode()
-        stderr += venv_install_stderr.read().decode()
-    except paramiko.SSHException:
-        _log.error(f"{machine_name}: Could not install virtualenv")
-        return early_exit(
-            output_dir_path,
-            stdout,
-            stderr,
-            machine_name,
-            heartbeat_thread,
-            heartbeat_event,
+        env_directory = f"{_VENV_CACHE_DIRECTORY}/{cache_key}"
+    else:
+        env_directory = f"{machine_directory}/env"
+    ready_file = f"{env_directory}/.remotescript_ready"
+    # mkdir is atomic on every platform, unlike flock which is missing on macOS,
+    # the lock holds the pid of the outer shell, which $$ gives in every stage
+    lock_dir = f"{env_directory}.lockdir"
+    lock_pid = f'"$(cat {lock_dir}/pid 2>/dev/null)"'
+    unlock_com = f'if [ {lock_pid} = "$$" ]; then rm -rf {lock_dir}; fi'
+    cached_com = ""
+    if use_cache:
+        cached_com = f'test -f {ready_file} && {env_directory}/bin/python -c "pass" || '
+    activate_com = ""
+    stages: list[tuple[str, str, bool]] = [
+        ("check_python", "python3 --version", True),
+        (
+            "extract_files",
+            f"tar xf {payload_path} -C {machine_directory} && rm {payload_path}",
+            True,
+        ),
+    ]
+    if use_cache:
+        # runs sharing the environment wait here until it is built and marked,
+        # a lock left by a run which was killed is taken over once its shell
+        # is gone, and the wait fails if the cache directory does not exist
+        lock_com = (
+            f"until mkdir {lock_dir} 2>/dev/null; do"
+            f" [ -d {_VENV_CACHE_DIRECTORY} ] || exit 1;"
+            f" pid={lock_pid};"
+            f' if [ -n "$pid" ] && ! kill -0 "$pid" 2>/dev/null;'
+            f" then rm -rf {lock_dir}; fi;"
+            f" sleep 1; done && echo $$ > {lock_dir}/pid"
         )
-
-    # create the virtual environment
+        stages.append(("lock_venv", lock_com, True))
     if not no_venv:
-        try:
-            venv_create_com = f"python3 -m venv {machine_directory}/env"
-            if use_system_site_packages:
-                venv_create_com += " --system-site-packages"
-            _, venv_create_stdout, venv_create_stderr = client.exec_command(
-                com_wrap(venv_create_com),
-            )
-            stdout += venv_create_stdout.read().decode()
-            stderr += venv_create_stderr.read().decode()
-            if venv_create_stderr.read().decode():
-                _log.error(f"{machine_name}: Could not create virtualenv")
-                return early_exit(
-                    output_dir_path,
-                    stdout,
-                    stderr,
-                    machine_name,
-                    heartbeat_thread,
-                    heartbeat_event,
-                )
-        except paramiko.SSHException:
-            _log.error(f"{machine_name}: Could not create virtualenv")
-            return early_exit(
-                output_dir_path,
-                stdout,
-                stderr,
-                machine_name,
-                heartbeat_thread,
-                heartbeat_event,
-            )
-
-    # install the dependencies
-    try:
-        base_install_com = (
-            f"python3 -m pip install -r {machine_directory}/requirements.txt;"
+        venv_args = env_directory
+        if use_system_site_packages:
+            venv_args += " --system-site-packages"
+        # virtualenv is only installed when the venv module is unusable,
+        # such as when python3-venv is not installed on Debian based systems
+        venv_create_com = (
+            f"rm -rf {env_directory} && (python3 -m venv {venv_args} ||"
+            f" (python3 -m pip install virtualenv && python3 -m virtualenv {venv_args}))"
+        )
+        stages.append(("create_venv", f"{cached_com}({venv_create_com})", True))
+        activate_com = f"source {env_directory}/bin/activate && "
+    if deps is not None:
+        # persistent wheel cache, so reinstalls do not download packages again
+        install_dep_com = (
+            f"PIP_CACHE_DIR={_PIP_CACHE_DIRECTORY} python3 -m pip install"
+            f" --prefer-binary -r {machine_directory}/requirements.txt"
+        )
+        stages.append(
+            ("install_deps", f"{cached_com}({activate_com}{install_dep_com})", True),
         )
-        install_dep_com = ""
-        if not no_venv:
-            install_dep_com += f"source {machine_directory}/env/bin/activate;"
-        install_dep_com += base_install_com
-        if not no_venv:
-            install_dep_com += "deactivate"
-        _, install_dep_stdout, install_dep_stderr = client.exec_command(
-            com_wrap(install_dep_com),
+    if use_cache:
+        stages.append(
+            ("mark_venv", f"touch {ready_file} && {unlock_com}", True),
+        )
+    stages.append(
+        (
+            "run",
+            f"{activate_com}cd {machine_directory} && python3 script.py",
+            False,
+        ),
+    )
+    if not use_cache:
+        stages.append(("clean_env", f"rm -rf {env_directory}", False))
+    script = compose_stages(stages)
+    if use_cache:
+        # the lock is released when the script exits, even if a stage fails
+        script = (
+            f"mkdir -p {_VENV_CACHE_DIRECTORY};"
+            f" trap {shlex.quote(unlock_com)} EXIT; {script}"
+        )
+    try:
+        command_stdout_text, command_stderr_text, command_status = run_command(
+            client,
+            wrap_command(bash, script),
         )
-        env_stdout_text = install_dep_stdout.read().decode()
-        env_stderr_text = install_dep_stderr.read().decode()
-        stdout += env_stdout_text
-        stderr += env_stderr_text
-
-        # evaluate the output of the virtualenv installation
-        for line in env_stderr_text.split("\n"):
-            line2 = line.strip()
-            if not line2:
-                continue
-            # stderr contains text that is not upgrade notice
-            if "[notice]" not in line2:
-                _log.error(
-                    f"{machine_name}: Error installing the dependencies",
-                )
-                return early_exit(
-                    output_dir_path,
-                    stdout,
-                    stderr,
-                    machine_name,
-                    heartbeat_thread,
-                    heartbeat_event,
-                )
     except paramiko.SSHException:
-        _log.error(f"{machine_name}: Could not install dependencies")
+        _log.error(f"{machine_name}: Could not run script")
         return early_exit(
             output_dir_path,
             stdout,
@@ -596,30 +716,34 @@ def run_script(
             machine_name,
             heartbeat_thread,
             heartbeat_event,
+            client,
         )
 
-    # run the script
-    try:
-        # start time
-        start_time = int(time.time())
-
-        # actual script run
-        command = f"cd {machine_directory};"
-        if not no_venv:
-            command += "source env/bin/activate;"
-        command += "python3 script.py;"
-        if not no_venv:
-            command += "deactivate"
-        _, command_stdout, command_stderr = client.exec_command(com_wrap(command))
-        script_stdout = command_stdout.read().decode()
-        script_stderr = command_stderr.read().decode()
-
-        # end time
-        end_time = int(time.time())
-        total_time = end_time - start_time
-        _log.debug(f"{machine_name}: Script ran in {total_time} seconds")
-    except paramiko.SSHException:
-        _log.error(f"{machine_name}: Could not run script")
+    # demux the output of each stage using the markers
+    out_stages = split_stages(command_stdout_text)
+    err_stages = split_stages(command_stderr_text)
+    script_stdout = ""
+    script_stderr = ""
+    start_time = 0.0
+    end_time = 0.0
+    script_status: int | None = None
+    for stage, start, end, status, text in out_stages:
+        if stage == "run":
+            script_stdout = text
+            start_time = start
+            end_time = end
+            script_status = status
+        else:
+            stdout += text
+    for stage, *_, text in err_stages:
+        if stage == "run":
+            script_stderr = text
+        else:
+            stderr += text
+    if command_status != 0:
+        failed_stage = out_stages[-1][0]
+        err_msg = _STAGE_ERRORS.get(failed_stage, f"Stage {failed_stage} failed")
+        _log.error(f"{machine_name}: {err_msg}")
         return early_exit(
             output_dir_path,
             stdout,
@@ -627,26 +751,20 @@ def run_script(
             machine_name,
             heartbeat_thread,
             heartbeat_event,
+            client,
         )
-
-    # clean the environment
-    try:
-        clean_env_com = f"rm -rf {machine_directory}/env"
-        client.exec_command(com_wrap(clean_env_com))
+    _log.debug(f"{machine_name}: Script ran in {end_time - start_time:.3f} seconds")
+    if script_status != 0:
+        _log.warning(f"{machine_name}: Script exited with status {script_status}")
+    if not use_cache:
         _log.debug(f"{machine_name}: Cleaned up environment")
-    except paramiko.SSHException:
-        _log.warning(f"{machine_name}: Could not clean up environment")
 
     # transfer the run directory into the output directory for the machine
     if transfer_run_dir:
         try:
-            scp_client.get(
-                f"{machine_directory}",
-                f"{output_dir_path}/{run_directory}",
-                recursive=True,
-            )
+            get_dir(client, machine_directory, output_dir_path / run_directory)
             _log.debug(f"{machine_name}: Transferred output directory")
-        except scp.SCPException as err:
+        except (paramiko.SSHException, OSError) as err:
             _log.error(
                 f"{machine_name}: Could not transfer output directory back to host: {err}",
             )
@@ -660,10 +778,11 @@ def run_script(
                 "stderr.txt",
             )
             close_heartbeat(heartbeat_thread, heartbeat_event)
+            release_client(client)
             return False
 
     # write final output files
-    write_output_json(output_dir_path, start_time, end_time)
+    write_output_json(output_dir_path, start_time, end_time, script_status)
     write_stdout_stderr(output_dir_path, stdout, stderr, machine_name)
     write_stdout_stderr(
         output_dir_path,
@@ -674,5 +793,6 @@ def run_script(
         "stderr.txt",
     )
     close_heartbeat(heartbeat_thread, heartbeat_event)
+    release_client(client)
 
     return True
@@ -3,17 +3,74 @@
 # MIT License
 from __future__ import annotations
 
+import ast
 import logging
 import re
+from collections import deque
+from functools import lru_cache
 from typing import TYPE_CHECKING
 
 from stdlib_list import stdlib_list
 
 if TYPE_CHECKING:
+    from collections.abc import Iterator
     from pathlib import Path
 
 _log = logging.getLogger(__name__)
 
+_IMPORT_RE = re.compile(
+    r"^(?:from[ ]+(\S+)[ ]+)?import[ ]+(\S+)(?:[ ]+as[ ]+\S+)?[ ]*$",
+)
+_IMPORT_ERRORS = frozenset(("ImportError", "ModuleNotFoundError"))
+_TRY_NODES = tuple(
+    getattr(ast, name) for name in ("Try", "TryStar") if hasattr(ast, name)
+)
+
+
+@lru_cache(maxsize=1)
+def _stdlibs() -> frozenset[str]:
+    # built on first use, so importing the package does not load the list
+    return frozenset(stdlib_list())
+
+
+def _name(node: ast.expr | None) -> str | None:
+    # the last part of a name such as TYPE_CHECKING or typing.TYPE_CHECKING
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _is_guarded(node: ast.AST) -> bool:
+    # imports behind an ImportError fallback or a TYPE_CHECKING block are
+    # optional or only used for typing, so they are not requirements
+    if isinstance(node, _TRY_NODES):
+        for handler in node.handlers:  # type: ignore[attr-defined]
+            kinds = (
+                handler.type.elts
+                if isinstance(handler.type, ast.Tuple)
+                else [handler.type]
+            )
+            if any(_name(kind) in _IMPORT_ERRORS for kind in kinds):
+                return True
+    return isinstance(node, ast.If) and _name(node.test) == "TYPE_CHECKING"
+
+
+def _iter_imports(tree: ast.AST) -> Iterator[ast.Import | ast.ImportFrom]:
+    # breadth first, in the same order as ast.walk
+    nodes: deque[ast.AST] = deque([tree])
+    while nodes:
+        node = nodes.popleft()
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            yield node
+        elif _is_guarded(node):
+            # the else branches still run unconditionally
+            nodes.extend(node.orelse)  # type: ignore[attr-defined]
+            nodes.extend(getattr(node, "finalbody", ()))
+        else:
+            nodes.extend(ast.iter_child_nodes(node))
+
 
 def parse_and_trim_imports(file_path: Path) -> list[tuple[str, str]]:
     """
@@ -23,6 +80,10 @@ def parse_and_trim_imports(file_path: Path) -> list[tuple[str, str]]:
     These imports are represented as tuples of two strings.
     The first string is populated if the import statement was in the form:
     from <module> import <name>
+    Module names are reduced to their top-level package and relative
+    imports are skipped, since neither can be installed by name.
+    Imports guarded by an ImportError handler or a TYPE_CHECKING
+    block are skipped as well.
 
     Parameters
     ----------
@@ -37,28 +98,28 @@ def parse_and_trim_imports(file_path: Path) -> list[tuple[str, str]]:
     """
     _log.debug(f"Parsing imports from {file_path}")
 
-    # Read the file and find import statements using regular expressions
-    matches: list[list[tuple[str, str]]] = [
-        re.findall(
-            r"(?m)^(?:from[ ]+(\S+)[ ]+)?import[ ]+(\S+)(?:[ ]+as[ ]+\S+)?[ ]*$",
-            line,
-        )
-        for line in file_path.open("r").readlines()
-    ]
-
-    # Trim empty entries from the list
-    num_matches = len(matches)
-    for i in range(num_matches - 1, -1, -1):
-        if not matches[i]:
-            matches.pop(i)
-
-    unnested: list[tuple[str, str]] = []
-    for match in matches:
-        unnested.extend(match)
-
-    _log.debug(f"Found {len(unnested)} imports in {file_path}")
-
-    return unnested
+    # parsing the raw bytes lets ast honour any encoding declaration in the file
+    try:
+        tree = ast.parse(file_path.read_bytes(), filename=str(file_path))
+    except SyntaxError:
+        # the script may target a newer Python than the local interpreter
+        _log.warning(f"Could not parse {file_path}, scanning for imports instead")
+        with file_path.open(encoding="utf-8", errors="replace") as f:
+            imports: list[tuple[str, str]] = [
+                match for line in f for match in _IMPORT_RE.findall(line)
+            ]
+    else:
+        imports = []
+        for node in _iter_imports(tree):
+            if isinstance(node, ast.Import):
+                imports.extend(("", alias.name.split(".")[0]) for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                module = node.module.split(".")[0]
+                imports.extend((module, alias.name) for alias in node.names)
+
+    _log.debug(f"Found {len(imports)} imports in {file_path}")
+
+    return imports
 
 
 def compare_and_prune_libs(libs: list[tuple[str, str]]) -> list[str]:
@@ -73,30 +134,16 @@ def compare_and_prune_libs(libs: list[tuple[str, str]]) -> list[str]:
     Returns
     -------
     list[str]
-        A list of libraries with standard libraries removed.
+        A list of libraries with standard libraries and duplicates removed.
 
     """
     starting_libs = len(libs)
-    stdlibs = stdlib_list()
-    valid_libs = []
-    for lib in libs:
-        # if lib[0] == "":
-        if not lib[0]:
-            if lib[1] not in stdlibs:
-                valid_libs.append(lib)
-        else:
-            if lib[0] not in stdlibs:
-                valid_libs.append(lib)
-    cleaned_libs = []
-    for vlib in valid_libs:
-        # if vlib[0] == "":
-        if not vlib[0]:
-            cleaned_libs.append(vlib[1])
-        else:
-            cleaned_libs.append(vlib[0])
+    stdlibs = _stdlibs()
+    names = (lib[0] or lib[1] for lib in libs)
+    cleaned_libs = list(dict.fromkeys(name for name in names if name not in stdlibs))
 
     _log.debug(
-        f"Removed {starting_libs - len(cleaned_libs)} standard libraries during cleaning",
+        f"Removed {starting_libs - len(cleaned_libs)} standard library or duplicate imports during cleaning",
     )
 
     return cleaned_libs
@@ -117,7 +164,4 @@ def generate_requirements(libs: list[str]) -> str:
         The requirements file as a string.
 
     """
-    reqs = ""
-    for lib in libs:
-        reqs += f"{lib}\n"
-    return reqs
+    return "\n".join(libs) + "\n" if libs else ""
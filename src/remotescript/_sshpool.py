@@ -0,0 +1,238 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+# ruff: noqa: S507
+from __future__ import annotations
+
+import atexit
+import contextlib
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING
+
+import paramiko
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+_log = logging.getLogger(__name__)
+
+# larger flow control window and packets than the paramiko defaults (2 MiB, 32 KiB)
+# to keep transfers from stalling on the window over high bandwidth-delay links,
+# packets are kept below the 256 KiB limit OpenSSH enforces
+_WINDOW_SIZE = 2**27
+_MAX_PACKET_SIZE = 2**17
+
+# like the ControlPersist option of OpenSSH, idle connections are only kept
+# around for a limited time before being closed
+_IDLE_TIMEOUT = 60.0
+
+_POOL: dict[tuple[str, str, int], deque[tuple[paramiko.SSHClient, float]]] = {}
+_POOL_KEYS: dict[paramiko.SSHClient, tuple[str, str, int]] = {}
+_POOL_LOCK = threading.Lock()
+
+
+def _is_active(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def _ping(client: paramiko.SSHClient) -> bool:
+    # a pooled connection may have been dropped by the server while idle,
+    # sending an ignore packet surfaces a dead socket before the client is reused
+    transport = client.get_transport()
+    if transport is None or not transport.is_active():
+        return False
+    try:
+        transport.send_ignore()
+    except (paramiko.SSHException, EOFError, OSError):
+        return False
+    return transport.is_active()
+
+
+def _pop_idle(now: float) -> list[paramiko.SSHClient]:
+    # must be called with _POOL_LOCK held, the clients are closed by the
+    # caller after releasing the lock, since closing waits on the network
+    idle: list[paramiko.SSHClient] = []
+    for clients in _POOL.values():
+        # clients are released onto the right, so the oldest are on the left
+        while clients and now - clients[0][1] > _IDLE_TIMEOUT:
+            client, _ = clients.popleft()
+            _POOL_KEYS.pop(client, None)
+            idle.append(client)
+    return idle
+
+
+def _close(clients: list[paramiko.SSHClient]) -> None:
+    for client in clients:
+        client.close()
+
+
+def acquire_client(
+    hostname: str,
+    user: str,
+    password: str,
+    port: int | None = None,
+    timeout: int = 5,
+    *,
+    compress: bool = True,
+) -> paramiko.SSHClient:
+    """
+    Get a connected client from the pool, or create a new one.
+
+    Pooled clients which have been idle for longer than 60 seconds
+    are closed instead of reused. Other pooled clients are pinged
+    before being reused, and closed if the ping fails.
+
+    Parameters
+    ----------
+    hostname : str
+        The hostname of the machine.
+    user : str
+        The user to connect as.
+    password : str
+        The password to connect with.
+    port : int | None
+        The port to connect on.
+        If None, the default is 22.
+    timeout : int
+        The timeout for the connection.
+    compress : bool
+        Whether to request compression for new connections.
+        If the server does not support compression, the
+        connection falls back to no compression.
+        By default, this is True.
+
+    Returns
+    -------
+    paramiko.SSHClient
+        The connected client.
+
+    """
+    port = port if port is not None else 22
+    key = (hostname, user, port)
+    while True:
+        # only the pool itself is touched under the lock, the ping and any
+        # closes happen outside of it so a slow socket does not block others
+        with _POOL_LOCK:
+            idle = _pop_idle(time.monotonic())
+            clients = _POOL.get(key)
+            pooled = clients.pop()[0] if clients else None
+        _close(idle)
+        if pooled is None:
+            break
+        if _ping(pooled):
+            _log.debug(f"Reusing connection to {user}@{hostname}:{port}")
+            return pooled
+        with _POOL_LOCK:
+            _POOL_KEYS.pop(pooled, None)
+        pooled.close()
+
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(
+        hostname=hostname,
+        username=user,
+        password=password,
+        port=port,
+        timeout=timeout,
+        compress=compress,
+    )
+    transport = client.get_transport()
+    if transport is not None:
+        transport.default_window_size = _WINDOW_SIZE
+        transport.default_max_packet_size = _MAX_PACKET_SIZE
+        # send small control packets immediately instead of waiting on Nagle,
+        # keepalive lets the OS detect dead peers alongside the heartbeat
+        sock = transport.sock
+        if isinstance(sock, socket.socket):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    _log.debug(f"Opened connection to {user}@{hostname}:{port}")
+    with _POOL_LOCK:
+        _POOL_KEYS[client] = key
+    return client
+
+
+def release_client(client: paramiko.SSHClient) -> None:
+    """
+    Return a client to the pool for reuse.
+
+    If the connection is no longer active, the client is closed instead.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        The client to return.
+
+    """
+    with _POOL_LOCK:
+        now = time.monotonic()
+        idle = _pop_idle(now)
+        key = _POOL_KEYS.get(client)
+        if key is not None and _is_active(client):
+            _POOL.setdefault(key, deque()).append((client, now))
+        else:
+            _POOL_KEYS.pop(client, None)
+            idle.append(client)
+    _close(idle)
+
+
+@contextlib.contextmanager
+def get_client(
+    hostname: str,
+    user: str,
+    password: str,
+    port: int | None = None,
+    timeout: int = 5,
+) -> Iterator[paramiko.SSHClient]:
+    """
+    Get a connected client from the pool for the duration of a context.
+
+    The client is returned to the pool on exit, or closed if an
+    error occurred while it was in use.
+
+    Parameters
+    ----------
+    hostname : str
+        The hostname of the machine.
+    user : str
+        The user to connect as.
+    password : str
+        The password to connect with.
+    port : int | None
+        The port to connect on.
+        If None, the default is 22.
+    timeout : int
+        The timeout for the connection.
+
+    Yields
+    ------
+    paramiko.SSHClient
+        The connected client.
+
+    """
+    client = acquire_client(hostname, user, password, port, timeout)
+    try:
+        yield client
+    except BaseException:
+        with _POOL_LOCK:
+            _POOL_KEYS.pop(client, None)
+        client.close()
+        raise
+    release_client(client)
+
+
+def close_all() -> None:
+    """Close all clients held by the pool."""
+    with _POOL_LOCK:
+        pooled = [client for clients in _POOL.values() for client, _ in clients]
+        _POOL.clear()
+        _POOL_KEYS.clear()
+    _close(pooled)
+
+
+atexit.register(close_all)
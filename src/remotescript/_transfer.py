@@ -0,0 +1,178 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+from __future__ import annotations
+
+import contextlib
+import logging
+import shutil
+import stat
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, TypeVar
+
+import paramiko
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+_BUFFER_SIZE = 2**20
+
+_T = TypeVar("_T")
+
+
+def _open_sftp(client: paramiko.SSHClient) -> paramiko.SFTPClient:
+    transport = client.get_transport()
+    sftp = None if transport is None else paramiko.SFTPClient.from_transport(transport)
+    if sftp is None:
+        err_msg = "Could not open SFTP channel, client is not connected"
+        raise paramiko.SSHException(err_msg)
+    return sftp
+
+
+def _get_file(
+    sftp: paramiko.SFTPClient,
+    remote_path: str,
+    local_path: Path,
+    file_size: int | None,
+) -> None:
+    # prefetching requests all blocks of the file up front
+    with sftp.open(remote_path, "rb") as remote_file, local_path.open(
+        "wb",
+    ) as local_file:
+        remote_file.prefetch(file_size)
+        shutil.copyfileobj(remote_file, local_file, _BUFFER_SIZE)
+    _log.debug(f"Transferred {remote_path} to {local_path}")
+
+
+def _bucket_by_size(
+    items: list[_T],
+    sizes: list[int],
+    num_buckets: int,
+) -> list[list[_T]]:
+    # spread the items round-robin from largest to smallest to balance the buckets
+    buckets: list[list[_T]] = [[] for _ in range(num_buckets)]
+    order = sorted(range(len(items)), key=sizes.__getitem__, reverse=True)
+    for idx, item_idx in enumerate(order):
+        buckets[idx % num_buckets].append(items[item_idx])
+    return buckets
+
+
+def put_archive(
+    client: paramiko.SSHClient,
+    remote_path: str,
+    paths: list[tuple[Path, str]],
+    parents: list[str] | None = None,
+) -> None:
+    """
+    Transfer files and directories to the remote machine as a single tar archive.
+
+    The archive is written directly into the remote file as it is built,
+    so it is never held in memory or written to disk locally. Directories
+    are added recursively and symlinks are replaced by their targets.
+    The archive is not compressed, since the connection is compressed
+    if the server supports it.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        The connected client to transfer the archive with.
+    remote_path : str
+        The path of the archive on the remote machine.
+    paths : list[tuple[Path, str]]
+        The files and directories to archive, in the form
+        (local path, name in the archive).
+    parents : list[str] | None
+        Directories to create on the remote machine, in order,
+        before the archive is transferred.
+        If None, no directories are created.
+
+    Raises
+    ------
+    paramiko.SSHException
+        If an SFTP channel could not be opened.
+    OSError
+        If a file could not be read or written.
+
+    """
+    with _open_sftp(client) as sftp:
+        for parent in parents or []:
+            # directory may already exist, any real failure surfaces on put
+            with contextlib.suppress(OSError):
+                sftp.mkdir(parent)
+        with sftp.open(remote_path, "wb") as remote_file:
+            remote_file.set_pipelined(True)
+            with tarfile.open(
+                fileobj=remote_file,
+                mode="w|",
+                bufsize=_BUFFER_SIZE,
+                dereference=True,
+            ) as tar:
+                for local_path, arcname in paths:
+                    tar.add(local_path, arcname=arcname)
+    _log.debug(f"Transferred {len(paths)} paths to {remote_path}")
+
+
+def get_dir(
+    client: paramiko.SSHClient,
+    remote_dir: str,
+    local_dir: Path,
+    max_workers: int = 4,
+) -> None:
+    """
+    Transfer a directory from the remote machine recursively.
+
+    The directory tree is listed and created locally first, then
+    the files are transferred concurrently, largest files first.
+
+    Parameters
+    ----------
+    client : paramiko.SSHClient
+        The connected client to transfer the directory with.
+    remote_dir : str
+        The directory on the remote machine to transfer.
+    local_dir : Path
+        The local directory to transfer into.
+    max_workers : int
+        The maximum number of concurrent transfers.
+        By default, this is 4.
+
+    Raises
+    ------
+    paramiko.SSHException
+        If an SFTP channel could not be opened.
+    OSError
+        If a file could not be read or written.
+
+    """
+    files: list[tuple[str, Path, int | None]] = []
+    with _open_sftp(client) as sftp:
+        pending = [(remote_dir, local_dir)]
+        while pending:
+            remote_root, local_root = pending.pop()
+            local_root.mkdir(parents=True, exist_ok=True)
+            for attr in sftp.listdir_attr(remote_root):
+                remote_path = f"{remote_root}/{attr.filename}"
+                local_path = local_root / attr.filename
+                if attr.st_mode is not None and stat.S_ISDIR(attr.st_mode):
+                    pending.append((remote_path, local_path))
+                elif attr.st_mode is not None and stat.S_ISREG(attr.st_mode):
+                    files.append((remote_path, local_path, attr.st_size))
+    if not files:
+        return
+    num_workers = min(max_workers, len(files))
+    buckets = _bucket_by_size(
+        files,
+        [file_size or 0 for _, _, file_size in files],
+        num_workers,
+    )
+
+    def _get_bucket(bucket: list[tuple[str, Path, int | None]]) -> None:
+        with _open_sftp(client) as sftp:
+            for remote_path, local_path, file_size in bucket:
+                _get_file(sftp, remote_path, local_path, file_size)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(_get_bucket, buckets))
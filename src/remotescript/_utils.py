@@ -3,47 +3,191 @@
 # MIT License
 from __future__ import annotations
 
-import argparse
-import configparser
 import json
 import logging
+import os
+import stat
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING, Literal, NamedTuple
+
+if TYPE_CHECKING:
+    import argparse
 
 _log = logging.getLogger(__name__)
 
+_PARALLEL_VALIDATION = 16
+_SHARED_PARENT = 2
+# in the order of the fields after the machine name in a parsed machine
+_MACHINE_KEYS = ("hostname", "username", "password", "port")
+_CONFIG_KINDS: dict[str, Literal["json", "ini"]] = {
+    ".json": "json",
+    ".cfg": "ini",
+    ".ini": "ini",
+}
+_SUFFIX_KINDS = {".py": "a Python script", ".txt": "a text file"}
 
-def parse_arguments() -> (
-    tuple[
-        Path,
-        Path,
-        Path,
-        list[Path],
-        Path | None,
-        list[Path],
-        list[Path],
-        int,
-        bool,
-        bool,
-    ]
-):
-    """
-    Parse the arguments and validate data.
 
-    Returns
-    -------
-    tuple[Path, Path, Path, list[Path], Path | None, list[Path], list[Path], int, bool, bool]
-        The parsed and validated arguments.
+class ParsedArgs(NamedTuple):
+    """
+    The parsed and validated command line arguments.
 
-    Raises
-    ------
-    FileNotFoundError
-        If any of the files do not exist.
-    ValueError
-        If any of the files are not of the correct type.
-        If the time method is not valid.
+    Attributes
+    ----------
+    script : Path
+        The script to execute on the remote machines.
+    config : Path
+        The configuration file for the remote machines.
+    config_kind : Literal["json", "ini"]
+        The format of the configuration file.
+    output_dir : Path
+        The output directory to aggregate the data into.
+    datafiles : list[Path]
+        The data files to transfer.
+    requirements : Path | None
+        The requirements file, if one was given.
+    dep_scripts : list[Path]
+        The dependency scripts to transfer.
+    dep_dirs : list[Path]
+        The dependency directories to transfer.
+    timeout : int
+        The timeout for the connection to the remote machines.
+    use_site_packages : bool
+        Whether to use the system site packages.
+    no_venv : bool
+        Whether to skip using a virtual environment.
+    no_venv_cache : bool
+        Whether to skip reusing a cached virtual environment.
+    workers : int | None
+        The maximum number of machines to run on concurrently.
 
     """
+
+    script: Path
+    config: Path
+    config_kind: Literal["json", "ini"]
+    output_dir: Path
+    datafiles: list[Path]
+    requirements: Path | None
+    dep_scripts: list[Path]
+    dep_dirs: list[Path]
+    timeout: int
+    use_site_packages: bool
+    no_venv: bool
+    no_venv_cache: bool
+    workers: int | None
+
+
+def _suffix(value: str) -> str:
+    # matches Path.suffix without constructing a path
+    name = os.path.basename(value.rstrip(os.sep + (os.altsep or "")))  # noqa: PTH119
+    return os.path.splitext(name)[1]  # noqa: PTH122
+
+
+def _exists(path: str) -> bool:
+    # access does not need to fill in a full stat result
+    return os.access(path, os.F_OK)
+
+
+def _classify(path: str) -> tuple[bool, bool]:
+    # a single stat answers both whether the path exists and whether it is a directory
+    try:
+        path_stat = os.stat(path)  # noqa: PTH116
+    except (FileNotFoundError, NotADirectoryError):
+        return False, False
+    return True, stat.S_ISDIR(path_stat.st_mode)
+
+
+def _validate_path(
+    value: str,
+    name: str,
+    suffix: str | None = None,
+    *,
+    is_dir: bool = False,
+    classified: tuple[bool, bool] | None = None,
+) -> Path:
+    # the checks work on the raw string, a Path is only built once they pass
+    if classified is not None:
+        exists, path_is_dir = classified
+    else:
+        # only directories need the type of the path, otherwise existence is enough
+        exists, path_is_dir = _classify(value) if is_dir else (_exists(value), False)
+    if not exists:
+        err_msg = f"{name} does not exist: {value}"
+        raise FileNotFoundError(err_msg)
+    if suffix is not None and _suffix(value) != suffix:
+        err_msg = f"{name} must be {_SUFFIX_KINDS[suffix]}: {value}"
+        raise ValueError(err_msg)
+    if is_dir and not path_is_dir:
+        err_msg = f"{name} must be a directory: {value}"
+        raise ValueError(err_msg)
+    return Path(value)
+
+
+def _scan_parents(values: list[str]) -> dict[str, tuple[bool, bool]]:
+    # group the paths by their parent directory, a parent holding several of
+    # them is listed once instead of stat-ing each path on its own, paths not
+    # found in the listing are left out and checked on their own
+    seps = os.sep + (os.altsep or "")
+    by_parent: dict[str, dict[str, list[str]]] = {}
+    for value in values:
+        parent, name = os.path.split(value.rstrip(seps))
+        if name in ("", os.curdir, os.pardir):
+            continue
+        names = by_parent.setdefault(parent or os.curdir, {})
+        names.setdefault(os.path.normcase(name), []).append(value)
+
+    classified: dict[str, tuple[bool, bool]] = {}
+    for parent, names in by_parent.items():
+        if len(names) < _SHARED_PARENT:
+            continue
+        try:
+            with os.scandir(parent) as it:
+                for entry in it:
+                    found = names.pop(os.path.normcase(entry.name), None)
+                    # symlinks may dangle, so they are still checked on their own
+                    if found is not None and not entry.is_symlink():
+                        result = (True, entry.is_dir())
+                        classified.update(dict.fromkeys(found, result))
+                    # stop listing a large directory once every path is found
+                    if not names:
+                        break
+        except OSError:
+            # leave these paths to the per-path checks, which report the error
+            continue
+    return classified
+
+
+def _validate_paths(args: list[tuple[str, str, str | None, bool]]) -> list[Path]:
+    # arguments are in the form (value, name, suffix, is_dir)
+    classified = _scan_parents([value for value, _, _, _ in args])
+
+    def _validate(arg: tuple[str, str, str | None, bool]) -> Path:
+        value, name, suffix, is_dir = arg
+        return _validate_path(
+            value,
+            name,
+            suffix,
+            is_dir=is_dir,
+            classified=classified.get(value),
+        )
+
+    if len(args) < _PARALLEL_VALIDATION:
+        return [_validate(arg) for arg in args]
+    # filesystem calls release the GIL, so on slow filesystems such as NFS
+    # the calls overlap, errors are still raised in the order of the arguments
+    with ThreadPoolExecutor(max_workers=min(32, len(args))) as executor:
+        return list(executor.map(_validate, args))
+
+
+@lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    # built on first use and reused, rather than on every call to parse_arguments,
+    # argparse is only imported here since only the command line needs it
+    import argparse  # noqa: PLC0415
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--script",
@@ -98,8 +242,39 @@ def parse_arguments() -> (
         action="store_true",
         help="Do not use a virtual environment.",
     )
+    parser.add_argument(
+        "--no-venv-cache",
+        action="store_true",
+        help="Do not reuse a cached virtual environment on the remote machines.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="The maximum number of machines to run on concurrently. By default, all machines run concurrently.",
+    )
+    return parser
+
+
+def parse_arguments() -> ParsedArgs:
+    """
+    Parse the arguments and validate data.
 
-    args = parser.parse_args()
+    Returns
+    -------
+    ParsedArgs
+        The parsed and validated arguments.
+
+    Raises
+    ------
+    FileNotFoundError
+        If any of the files do not exist.
+    ValueError
+        If any of the files are not of the correct type.
+        If the configuration file is not a json or cfg/ini file.
+        If the number of workers is not valid.
+
+    """
+    args = _build_parser().parse_args()
     input_file_str: str = args.script
     config_file_str: str = args.config
     output_dir_str: str = args.output or f"output_{int(time.time())}"
@@ -110,73 +285,56 @@ def parse_arguments() -> (
     timeout: int = args.timeout
     use_site_packages: bool = args.system_site_packages
     no_venv: bool = args.no_venv
+    no_venv_cache: bool = args.no_venv_cache
+    workers: int | None = args.workers
 
-    input_file = Path(input_file_str)
-    if not input_file.exists():
-        err_msg = f"Input file does not exist: {input_file}"
-        raise FileNotFoundError(err_msg)
-    if input_file.suffix != ".py":
-        err_msg = f"Input file must be a Python script: {input_file}"
+    input_file = _validate_path(input_file_str, "Input file", ".py")
+    config_file = _validate_path(config_file_str, "Config file")
+    config_kind = _CONFIG_KINDS.get(_suffix(config_file_str))
+    if config_kind is None:
+        err_msg = f"Invalid config file type: {config_file_str}"
         raise ValueError(err_msg)
 
-    config_file = Path(config_file_str)
-    if not config_file.exists():
-        err_msg = f"Config file does not exist: {config_file}"
-        raise FileNotFoundError(err_msg)
-
-    output_dir = Path(output_dir_str)
-    if output_dir.exists():
-        if output_dir.is_file():
-            err_msg = f"Output directory is a file: {output_dir}"
-            raise ValueError(err_msg)
-        err_msg = f"Output directory already exists: {output_dir}"
-        err_msg += " file contents will be overwritten."
-        _log.warning(err_msg)
-
-    datafile_paths: list[Path] = []
-    for datafile in datafiles:
-        datafile_path = Path(datafile)
-        if not datafile_path.exists():
-            err_msg = f"Data file does not exist: {datafile_path}"
-            raise FileNotFoundError(err_msg)
-        datafile_paths.append(datafile_path)
-
-    requirements_retval: Path | None = None
-    if requirements_file is not None:
-        requirements_path = Path(requirements_file)
-        if not requirements_path.exists():
-            err_msg = f"Requirements file does not exist: {requirements_path}"
-            raise FileNotFoundError(err_msg)
-        if requirements_path.suffix != ".txt":
-            err_msg = f"Requirements file must be a text file: {requirements_path}"
-            raise ValueError(err_msg)
-        requirements_retval = requirements_path
-
-    dep_script_paths: list[Path] = []
-    for dep_script in deps_scripts:
-        dep_script_path = Path(dep_script)
-        if not dep_script_path.exists():
-            err_msg = f"Dependency script does not exist: {dep_script_path}"
-            raise FileNotFoundError(err_msg)
-        if dep_script_path.suffix != ".py":
-            err_msg = f"Dependency script must be a Python script: {dep_script_path}"
-            raise ValueError(err_msg)
-        dep_script_paths.append(dep_script_path)
-
-    dep_dir_paths: list[Path] = []
-    for dep_dir in dep_dirs:
-        dep_dir_path = Path(dep_dir)
-        if not dep_dir_path.exists():
-            err_msg = f"Dependency directory does not exist: {dep_dir_path}"
-            raise FileNotFoundError(err_msg)
-        if not dep_dir_path.is_dir():
-            err_msg = f"Dependency directory must be a directory: {dep_dir_path}"
+    output_exists, output_is_dir = _classify(output_dir_str)
+    if output_exists:
+        if not output_is_dir:
+            err_msg = f"Output directory is a file: {output_dir_str}"
             raise ValueError(err_msg)
-        dep_dir_paths.append(dep_dir_path)
+        if _log.isEnabledFor(logging.WARNING):
+            _log.warning(
+                f"Output directory already exists: {output_dir_str} file contents will be overwritten.",
+            )
+    output_dir = Path(output_dir_str)
+
+    if workers is not None and workers < 1:
+        err_msg = f"Number of workers must be at least 1: {workers}"
+        raise ValueError(err_msg)
+
+    requirements_retval = (
+        _validate_path(requirements_file, "Requirements file", ".txt")
+        if requirements_file is not None
+        else None
+    )
+    paths = _validate_paths(
+        [
+            *((datafile, "Data file", None, False) for datafile in datafiles),
+            *(
+                (dep_script, "Dependency script", ".py", False)
+                for dep_script in deps_scripts
+            ),
+            *((dep_dir, "Dependency directory", None, True) for dep_dir in dep_dirs),
+        ],
+    )
+    num_datafiles = len(datafiles)
+    num_dep_files = num_datafiles + len(deps_scripts)
+    datafile_paths = paths[:num_datafiles]
+    dep_script_paths = paths[num_datafiles:num_dep_files]
+    dep_dir_paths = paths[num_dep_files:]
 
-    return (
+    return ParsedArgs(
         input_file,
         config_file,
+        config_kind,
         output_dir,
         datafile_paths,
         requirements_retval,
@@ -185,63 +343,133 @@ def parse_arguments() -> (
         timeout,
         use_site_packages,
         no_venv,
+        no_venv_cache,
+        workers,
     )
 
 
+def _port(value: object, machine_name: str) -> int | None:
+    # checking the characters first avoids raising and catching an error from int
+    if not value:
+        return None
+    if isinstance(value, str):
+        if value.isdecimal():
+            return int(value)
+    elif isinstance(value, int) and not isinstance(value, bool):
+        # json configs may give the port as a number
+        return value
+    err_msg = f"Invalid port number for machine: {machine_name}"
+    raise ValueError(err_msg)
+
+
+def _validate_machine(
+    machine_name: str,
+    host: str | None,
+    user: str | None,
+    password: str | None,
+    port_value: object,
+) -> tuple[str, str, str, str, int | None]:
+    max_port = 65535
+    if host is None:
+        err_msg = f"Missing hostname for machine: {machine_name}"
+        raise ValueError(err_msg)
+    if user is None:
+        err_msg = f"Missing username for machine: {machine_name}"
+        raise ValueError(err_msg)
+    if password is None:
+        err_msg = f"Missing password for machine: {machine_name}"
+        raise ValueError(err_msg)
+    port = _port(port_value, machine_name)
+    if port is not None and not 0 < port < max_port:
+        err_msg = f"Invalid port number for machine: {machine_name}"
+        raise ValueError(err_msg)
+    return machine_name, host, user, password, port
+
+
 def _parse_json_config(
     config_path: Path,
-) -> list[tuple[str, str | None, str | None, str | None, int | None]]:
-    config_list = []
-    with config_path.open(mode="r", encoding="utf-8") as f:
-        config: dict[str, dict[str, dict[str, str]]] = json.load(f)
-        machines_config: dict[str, dict[str, str]] = config["machines"]
-    for machine_name, machine_data in machines_config.items():
-        host = machine_data.get("hostname")
-        user = machine_data.get("username")
-        password = machine_data.get("password")
-        try:
-            md_port = machine_data.get("port")
-            port = int(md_port) if md_port else None
-        except ValueError as err:
-            err_msg = f"Invalid port number for machine: {machine_name}"
-            raise ValueError(err_msg) from err
-        config_list.append((machine_name, host, user, password, port))
-    return config_list
+) -> list[tuple[str, str, str, str, int | None]]:
+    # json detects the utf-8 encoding of the raw bytes itself
+    config: dict[str, dict[str, dict[str, str]]] = json.loads(config_path.read_bytes())
+    machines_config: dict[str, dict[str, str]] = config["machines"]
+    # validated as it is parsed, so an invalid machine fails immediately
+    return [
+        _validate_machine(machine_name, *map(machine_data.get, _MACHINE_KEYS))
+        for machine_name, machine_data in machines_config.items()
+    ]
+
+
+def _read_ini(config_path: Path) -> dict[str, dict[str, str]]:
+    # a minimal reader covering the parts of the INI format used by configparser
+    # for machine configs: [sections], key = value or key: value pairs, # and ;
+    # comment lines, indented continuation lines, and a DEFAULT section whose
+    # options apply to every section, keys are case-insensitive
+    defaults: dict[str, str] = {}
+    sections: dict[str, dict[str, str]] = {}
+    current: dict[str, str] | None = None
+    key: str | None = None
+    for lineno, raw_line in enumerate(
+        config_path.read_bytes().decode("utf-8").splitlines(),
+        start=1,
+    ):
+        line = raw_line.strip()
+        if not line or line[0] in "#;":
+            key = None
+            continue
+        if raw_line[0].isspace() and current is not None and key is not None:
+            current[key] += f"\n{line}"
+            continue
+        if line[0] == "[" and line[-1] == "]":
+            name = line[1:-1]
+            if name == "DEFAULT":
+                current = defaults
+            elif name in sections:
+                err_msg = f"Duplicate section {name} in config file: {config_path}"
+                raise ValueError(err_msg)
+            else:
+                current = sections[name] = {}
+            key = None
+            continue
+        # the first of either separator splits the key from the value
+        sep = min(
+            (idx for idx in (line.find("="), line.find(":")) if idx > 0),
+            default=-1,
+        )
+        if current is None or sep < 0:
+            err_msg = f"Invalid line {lineno} in config file: {config_path}"
+            raise ValueError(err_msg)
+        key = line[:sep].strip().lower()
+        current[key] = line[sep + 1 :].strip()
+    return {name: {**defaults, **options} for name, options in sections.items()}
 
 
 def _parse_cfg_config(
     config_path: Path,
-) -> list[tuple[str, str | None, str | None, str | None, int | None]]:
-    config_list = []
-    config: configparser.ConfigParser = configparser.ConfigParser()
-    config.read(config_path)
-    for section in config.sections():
-        machine_name = section
-        host = config[section].get("hostname")
-        user = config[section].get("username")
-        password = config[section].get("password")
-        try:
-            port = (
-                int(config[section].get("port"))
-                if config[section].get("port")
-                else None
-            )
-        except ValueError as err:
-            err_msg = f"Invalid port number for machine: {machine_name}"
-            raise ValueError(err_msg) from err
-        config_list.append((machine_name, host, user, password, port))
-    return config_list
+) -> list[tuple[str, str, str, str, int | None]]:
+    return [
+        _validate_machine(section, *map(options.get, _MACHINE_KEYS))
+        for section, options in _read_ini(config_path).items()
+    ]
 
 
-def parse_config(config_path: Path) -> list[tuple[str, str, str, str, int | None]]:
+def parse_config(
+    config_path: Path,
+    kind: Literal["json", "ini"] | None = None,
+) -> list[tuple[str, str, str, str, int | None]]:
     """
     Parse the configuration file.
 
+    The parsed configuration is cached, and reused until the
+    modification time or size of the file changes.
+
     Parameters
     ----------
     config_path : Path
         The path to the configuration file.
         A configuration file can be either a json or cfg/ini file.
+    kind : Literal["json", "ini"], optional
+        The format of the configuration file, if already known.
+        By default None, which infers the format from the file suffix.
 
     Returns
     -------
@@ -255,30 +483,33 @@ def parse_config(config_path: Path) -> list[tuple[str, str, str, str, int | None
         If the configuration file is not a json or cfg/ini file.
 
     """
-    config_list = []
-    if config_path.suffix == ".json":
-        config_list = _parse_json_config(config_path)
-    elif config_path.suffix in [".cfg", ".ini"]:
-        config_list = _parse_cfg_config(config_path)
-    else:
-        err_msg = f"Invalid config file type: {config_path}"
-        raise ValueError(err_msg)
-
-    # perform some validation
-    max_port = 65535
-    for machine_name, host, user, password, port in config_list:
-        if host is None:
-            err_msg = f"Missing hostname for machine: {machine_name}"
-            raise ValueError(err_msg)
-        if user is None:
-            err_msg = f"Missing username for machine: {machine_name}"
-            raise ValueError(err_msg)
-        if password is None:
-            err_msg = f"Missing password for machine: {machine_name}"
-            raise ValueError(err_msg)
-        if port is not None and not 0 < port < max_port:
-            err_msg = f"Invalid port number for machine: {machine_name}"
+    if kind is None:
+        kind = _CONFIG_KINDS.get(config_path.suffix)
+        if kind is None:
+            err_msg = f"Invalid config file type: {config_path}"
             raise ValueError(err_msg)
+    config_stat = config_path.stat()
+    return list(
+        _parse_config(
+            str(config_path),
+            kind,
+            config_stat.st_mtime_ns,
+            config_stat.st_size,
+        ),
+    )
+
 
-    # for-loop above verifies that the str items are not None
-    return config_list  # type: ignore[return-value]
+@lru_cache(maxsize=32)
+def _parse_config(
+    config_path_str: str,
+    kind: Literal["json", "ini"],
+    mtime_ns: int,  # noqa: ARG001
+    size: int,  # noqa: ARG001
+) -> tuple[tuple[str, str, str, str, int | None], ...]:
+    # the modification time and size are only part of the cache key
+    config_path = Path(config_path_str)
+    if kind == "json":
+        config_list = _parse_json_config(config_path)
+    else:
+        config_list = _parse_cfg_config(config_path)
+    return tuple(config_list)
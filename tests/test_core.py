@@ -0,0 +1,65 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+import shutil
+import subprocess
+
+import pytest
+
+from remotescript._core import _STAGE_MARKER, compose_stages, split_stages
+
+BASH = shutil.which("bash")
+
+
+def _run(stages):
+    script = compose_stages(stages)
+    assert "\n" not in script
+    result = subprocess.run(
+        [BASH, "-c", script],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    return result.returncode, split_stages(result.stdout), split_stages(result.stderr)
+
+
+@pytest.mark.skipif(BASH is None, reason="bash is not available")
+def test_stages_without_trailing_newline():
+    status, out, err = _run(
+        [("setup", "printf x", True), ("run", "printf y; printf z >&2; exit 4", False)],
+    )
+    assert status == 0
+    assert [(name, status, text) for name, _, _, status, text in out] == [
+        ("", 0, ""),
+        ("setup", 0, "x"),
+        ("run", 4, "y"),
+        ("done", None, ""),
+    ]
+    assert [text for *_, text in err] == ["", "", "z", ""]
+    _, start, end, _, _ = out[2]
+    assert 0 < start <= end
+
+
+@pytest.mark.skipif(BASH is None, reason="bash is not available")
+def test_stages_failed_required():
+    status, out, _ = _run(
+        [("setup", "echo failed; exit 3", True), ("run", "echo ran", False)],
+    )
+    assert status == 1
+    assert [name for name, *_ in out] == ["", "setup"]
+    assert out[-1][3:] == (None, "failed\n")
+
+
+def test_split_stages_comma_decimal():
+    text = f"{_STAGE_MARKER} run 0 1,5\nout\n{_STAGE_MARKER} done 2 3,25\n"
+    assert split_stages(text) == [
+        ("", 1.5, 1.5, 0, ""),
+        ("run", 1.5, 3.25, 2, "out\n"),
+        ("done", 3.25, 3.25, None, ""),
+    ]
+
+
+def test_split_stages_missing_run():
+    stages = split_stages("no markers")
+    assert stages == [("", 0.0, 0.0, None, "no markers")]
+    assert "run" not in [name for name, *_ in stages]
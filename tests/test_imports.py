@@ -0,0 +1,60 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+from remotescript._imports import compare_and_prune_libs, parse_and_trim_imports
+
+
+def test_parse_imports(tmp_path):
+    script = tmp_path / "script.py"
+    script.write_text(
+        "import os\n"
+        "import numpy as np\n"
+        "import a, b\n"
+        "from scipy.signal import butter\n"
+        "from x import (\n"
+        "    y,\n"
+        "    z,\n"
+        ")\n"
+        "from . import rel\n"
+        "def f():\n"
+        "    import lazy\n",
+    )
+    imports = parse_and_trim_imports(script)
+    assert set(imports) == {
+        ("", "os"),
+        ("", "numpy"),
+        ("", "a"),
+        ("", "b"),
+        ("scipy", "butter"),
+        ("x", "y"),
+        ("x", "z"),
+        ("", "lazy"),
+    }
+
+
+def test_parse_imports_invalid_syntax(tmp_path):
+    script = tmp_path / "script.py"
+    script.write_text("import numpy\nprint 'python2'\n")
+    assert parse_and_trim_imports(script) == [("", "numpy")]
+
+
+def test_parse_imports_guarded(tmp_path):
+    script = tmp_path / "script.py"
+    script.write_text(
+        "from typing import TYPE_CHECKING\n"
+        "import numpy\n"
+        "try:\n"
+        "    import cPickle as pickle\n"
+        "except ImportError:\n"
+        "    import pickle\n"
+        "try:\n"
+        "    import ujson as json\n"
+        "except (ModuleNotFoundError, ValueError):\n"
+        "    import json\n"
+        "else:\n"
+        "    import scipy\n"
+        "if TYPE_CHECKING:\n"
+        "    import pandas\n",
+    )
+    libs = compare_and_prune_libs(parse_and_trim_imports(script))
+    assert libs == ["numpy", "scipy"]
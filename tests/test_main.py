@@ -0,0 +1,22 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+import paramiko
+
+from remotescript.__main__ import _run_jobs
+
+
+def test_run_jobs_failure_does_not_stop_others():
+    ran = []
+
+    def _fail():
+        err_msg = "Authentication failed"
+        raise paramiko.AuthenticationException(err_msg)
+
+    jobs = [
+        ("machine1", _fail),
+        ("machine2", lambda: ran.append("machine2")),
+        ("machine3", lambda: ran.append("machine3")),
+    ]
+    _run_jobs(jobs, 1)
+    assert ran == ["machine2", "machine3"]
@@ -0,0 +1,93 @@
+# Copyright (c) 2024 Justin Davis (davisjustin302@gmail.com)
+#
+# MIT License
+from pathlib import Path
+
+import pytest
+
+from remotescript._utils import _scan_parents, _validate_paths, parse_config
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+
+
+def test_parse_config_json():
+    assert parse_config(EXAMPLES / "example_config.json") == [
+        ("machine1", "example.com", "user1", "password1", 22),
+        ("machine2", "example.com", "user2", "password2", None),
+    ]
+
+
+def test_parse_config_cfg():
+    assert parse_config(EXAMPLES / "example_config.cfg") == [
+        ("machine1", "example1.com", "user1", "pass1", 22),
+        ("machine2", "example2.com", "user2", "pass2", None),
+    ]
+
+
+def test_parse_config_invalid(tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text('{"machines": {"m": {"hostname": "h", "username": "u"}}}')
+    with pytest.raises(ValueError, match="Missing password"):
+        parse_config(config)
+    with pytest.raises(ValueError, match="Invalid config file type"):
+        parse_config(tmp_path / "config.yaml")
+
+
+def test_parse_config_cache(tmp_path):
+    config = tmp_path / "config.cfg"
+    config.write_text("[m]\nhostname = h\nusername = u\npassword = p\n")
+    assert parse_config(config) == [("m", "h", "u", "p", None)]
+    config.write_text("[m]\nhostname = h\nusername = u\npassword = p\nport = 2222\n")
+    assert parse_config(config) == [("m", "h", "u", "p", 2222)]
+
+
+def test_parse_config_cfg_defaults(tmp_path):
+    config = tmp_path / "config.ini"
+    config.write_text(
+        "; shared login\n"
+        "[DEFAULT]\n"
+        "UserName = shared\n"
+        "password: p%ss\n"
+        "\n"
+        "[m1]\n"
+        "hostname = h1\n"
+        "# overrides the default\n"
+        "username = own\n"
+        "[m2]\n"
+        "hostname = h2\n"
+        "port = 2222\n",
+    )
+    assert parse_config(config) == [
+        ("m1", "h1", "own", "p%ss", None),
+        ("m2", "h2", "shared", "p%ss", 2222),
+    ]
+
+
+def test_parse_config_kind(tmp_path):
+    config = tmp_path / "machines"
+    config.write_text("[m]\nhostname = h\nusername = u\npassword = p\n")
+    assert parse_config(config, kind="ini") == [("m", "h", "u", "p", None)]
+    with pytest.raises(ValueError, match="Invalid config file type"):
+        parse_config(config)
+
+
+def test_validate_paths_shared_parent(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("a")
+    (data / "b.txt").write_text("b")
+    (data / "sub").mkdir()
+    found = [str(data / name) for name in ("a.txt", "b.txt", "sub")]
+    # paths missing from the listing are left to the per-path checks
+    unknown = [str(data / "missing.txt")]
+    assert _scan_parents(found + unknown) == {
+        found[0]: (True, False),
+        found[1]: (True, False),
+        found[2]: (True, True),
+    }
+    assert _validate_paths([(v, "Data file", None, False) for v in found]) == [
+        Path(v) for v in found
+    ]
+    args = [(v, "Data file", None, False) for v in (found[0], unknown[0])]
+    with pytest.raises(FileNotFoundError, match="Data file does not exist"):
+        _validate_paths(args)